@@ -1,32 +1,254 @@
-import argparse
-import json
+from __future__ import annotations
+
+import asyncio
+import atexit
+import hashlib
 import os
+import random
+import re
 import sys
-import subprocess
-from typing import Dict, Any
+import uuid
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Tuple
 
-from openai import OpenAI
+# httpx, openai, and orjson are imported lazily at first use so error paths
+# (bad args, missing API key) and import-light sessions skip their cost
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 API_KEY = os.getenv("OPENROUTER_API_KEY")
 BASE_URL = os.getenv("OPENROUTER_BASE_URL", default="https://openrouter.ai/api/v1")
 
+# Per-request timeout; stalled upstreams otherwise freeze the whole agent
+REQUEST_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", default="15"))
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0  # seconds
+RETRY_MAX_DELAY = 8.0  # seconds
+
+# Per-call ceiling on Read output so one huge file can't bloat every
+# subsequent turn's upload
+READ_MAX_BYTES = 256 * 1024
+
+# Once the history holds this many content characters, tool results older
+# than the most recent few are elided to keep per-turn uploads bounded
+HISTORY_SIZE_THRESHOLD = 200_000
+HISTORY_KEEP_TOOL_RESULTS = 8
+
+# Limits for Bash tool subprocesses
+BASH_TIMEOUT = float(os.getenv("BASH_TIMEOUT", default="120"))
+BASH_MAX_OUTPUT_LINES = 1000  # per stream; older lines are dropped
+BASH_STREAM_LIMIT = 1024 * 1024  # max single line; readline's default 64 KiB is too small
+
+
+def _read_span(file_path: str, offset: int, limit: int) -> Tuple[bytes, int]:
+    """Read up to limit bytes at offset into a preallocated buffer.
+
+    Reading straight through the fd skips the TextIOWrapper buffering and
+    extra copy that open(path).read() pays; decoding happens once, later.
+    Returns (data, file_size).
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        want = max(0, min(limit, size - offset))
+        buf = bytearray(want)
+        view = memoryview(buf)
+        n = 0
+        while n < want:
+            read = os.preadv(fd, [view[n:]], offset + n)
+            if read == 0:
+                break
+            n += read
+        return bytes(view[:n]), size
+    finally:
+        os.close(fd)
+
+
+# LRU cache of decoded Read results keyed by path, span, and stat signature.
+# A changed mtime or size misses naturally, so stale entries just age out.
+_READ_CACHE: OrderedDict = OrderedDict()
+_READ_CACHE_MAX = 128
+
+
+# JSON-escaped fragments of tool outputs, memoized so repeat encodes of the
+# same result don't re-escape a large string; populated on demand by
+# ReadMany assembly, the only consumer of the escaped form
+_FRAGMENT_CACHE: OrderedDict = OrderedDict()
+_FRAGMENT_CACHE_MAX = 64
+
+
+def dumps_fragment(text: str) -> bytes:
+    """Return the JSON string literal for text, escaping it at most once."""
+    import orjson
+
+    fragment = _FRAGMENT_CACHE.get(text)
+    if fragment is None:
+        fragment = orjson.dumps(text)
+        _FRAGMENT_CACHE[text] = fragment
+        if len(_FRAGMENT_CACHE) > _FRAGMENT_CACHE_MAX:
+            _FRAGMENT_CACHE.popitem(last=False)
+    else:
+        _FRAGMENT_CACHE.move_to_end(text)
+    return fragment
+
+
+def _purge_read_cache(file_path: str) -> None:
+    """Drop cached reads for a path that is about to be rewritten."""
+    for key in [k for k in _READ_CACHE if k[0] == file_path]:
+        del _READ_CACHE[key]
+
 
-def execute_read_tool(arguments: Dict[str, Any]) -> str:
-    """Execute the Read tool and return the file contents."""
+async def execute_read_tool(arguments: Dict[str, Any]) -> str:
+    """Execute the Read tool and return a bounded slice of the file contents."""
     file_path = arguments.get("file_path")
     if not file_path:
         raise RuntimeError("file_path parameter is missing")
 
+    offset = int(arguments.get("offset") or 0)
+    max_bytes = int(arguments.get("max_bytes") or READ_MAX_BYTES)
+
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+        st = os.stat(file_path)
     except FileNotFoundError:
         raise RuntimeError(f"File not found: {file_path}")
     except IOError as e:
         raise RuntimeError(f"Error reading file {file_path}: {e}")
 
+    # Repeat reads of an unchanged file skip the syscalls and decode entirely
+    cache_key = (file_path, offset, max_bytes, st.st_mtime_ns, st.st_size)
+    cached = _READ_CACHE.get(cache_key)
+    if cached is not None:
+        _READ_CACHE.move_to_end(cache_key)
+        return cached
+
+    try:
+        # Read one extra byte so truncation can be detected
+        data, size = await asyncio.to_thread(_read_span, file_path, offset, max_bytes + 1)
+    except FileNotFoundError:
+        raise RuntimeError(f"File not found: {file_path}")
+    except IOError as e:
+        raise RuntimeError(f"Error reading file {file_path}: {e}")
+
+    truncated = len(data) > max_bytes
+    if truncated:
+        data = data[:max_bytes]
+
+    text = data.decode('utf-8', 'replace')
+    if truncated:
+        # Bound what lands in the conversation; the model can page through
+        # the rest with follow-up offsets instead of one giant upload
+        remaining = size - (offset + max_bytes)
+        text += (f"\n... [truncated {remaining} bytes; "
+                 f"call Read again with offset={offset + max_bytes}]")
+
+    _READ_CACHE[cache_key] = text
+    if len(_READ_CACHE) > _READ_CACHE_MAX:
+        _READ_CACHE.popitem(last=False)
+    return text
+
+
+async def execute_read_many_tool(arguments: Dict[str, Any]) -> str:
+    """Execute the ReadMany tool: read several files concurrently in one call."""
+    file_paths = arguments.get("file_paths")
+    if not file_paths:
+        raise RuntimeError("file_paths parameter is missing")
+
+    results = await asyncio.gather(
+        *[execute_read_tool({"file_path": path}) for path in file_paths],
+        return_exceptions=True
+    )
+
+    # Assemble the JSON array from pre-escaped fragments; per-file errors are
+    # reported in place so one bad path doesn't fail the whole batch
+    parts = []
+    for path, result in zip(file_paths, results):
+        if isinstance(result, BaseException):
+            result = f"Error: {result}"
+        parts.append(b'{"file_path":' + dumps_fragment(path) +
+                     b',"content":' + dumps_fragment(result) + b'}')
+    return (b'[' + b','.join(parts) + b']').decode('utf-8')
+
+
+async def execute_write_many_tool(arguments: Dict[str, Any]) -> str:
+    """Execute the WriteMany tool: write several files concurrently in one call."""
+    files = arguments.get("files")
+    if not files:
+        raise RuntimeError("files parameter is missing")
+
+    results = await asyncio.gather(
+        *[execute_write_tool(entry) for entry in files],
+        return_exceptions=True
+    )
+
+    return '\n'.join(
+        f"Error: {result}" if isinstance(result, BaseException) else result
+        for result in results
+    )
+
+
+# File-path-looking tokens in tool output worth prefetching into the read
+# cache while the model is busy generating its next turn
+_PATH_RE = re.compile(r"[\w./-]+\.(?:py|md|txt|json|yml|toml|ts|js|rs|go)\b")
+_WARM_MAX_CANDIDATES = 4
+_WARM_TASKS: set = set()
+
+
+async def _warm_read(file_path: str) -> None:
+    """Populate the read cache in the background; failures don't matter."""
+    try:
+        await execute_read_tool({"file_path": file_path})
+    except (RuntimeError, OSError):
+        pass
+
+
+def _prefetch_candidates(text: str) -> None:
+    """Start warm reads for existing files mentioned in fresh tool output."""
+    candidates = []
+    for match in _PATH_RE.finditer(text):
+        path = match.group(0)
+        if path not in candidates and os.path.isfile(path):
+            candidates.append(path)
+        if len(candidates) == _WARM_MAX_CANDIDATES:
+            break
+    for path in candidates:
+        task = asyncio.create_task(_warm_read(path))
+        _WARM_TASKS.add(task)
+        task.add_done_callback(_WARM_TASKS.discard)
+
+
+# Directories already created by this process; skips repeat mkdir syscalls
+# when the agent writes many files under the same tree
+_ENSURED_DIRS: set = set()
+
+
+def _ensure_directory(directory: str) -> None:
+    """Create a directory once per process, remembering what already exists."""
+    if directory in _ENSURED_DIRS:
+        return
+    os.makedirs(directory, exist_ok=True)
+    # Record the directory and all its parents so sibling writes short-circuit
+    while directory and directory not in _ENSURED_DIRS:
+        _ENSURED_DIRS.add(directory)
+        directory = os.path.dirname(directory)
+
+
+def _write_bytes(file_path: str, data: bytes) -> None:
+    """Write data to a raw fd in one os.write loop.
+
+    Skips the TextIOWrapper incremental encoder and its buffer copy; no
+    fsync, since agent scratch files don't need durability guarantees.
+    """
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        n = 0
+        while n < len(data):
+            n += os.write(fd, view[n:])
+    finally:
+        os.close(fd)
+
 
-def execute_write_tool(arguments: Dict[str, Any]) -> str:
+async def execute_write_tool(arguments: Dict[str, Any]) -> str:
     """Execute the Write tool to write content to a file."""
     file_path = arguments.get("file_path")
     content = arguments.get("content")
@@ -36,71 +258,179 @@ def execute_write_tool(arguments: Dict[str, Any]) -> str:
     if content is None:  # content could be empty string, which is valid
         raise RuntimeError("content parameter is missing")
 
+    # Keep cached reads coherent with what is on disk
+    _purge_read_cache(file_path)
+
     try:
         # Create directory if it doesn't exist
         directory = os.path.dirname(file_path)
         if directory:
-            os.makedirs(directory, exist_ok=True)
+            _ensure_directory(directory)
 
         # Write content to file
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write(content)
+        await asyncio.to_thread(_write_bytes, file_path, content.encode('utf-8'))
         return f"Successfully wrote to {file_path}"
     except IOError as e:
         raise RuntimeError(f"Error writing to file {file_path}: {e}")
 
 
-def execute_bash_tool(arguments: Dict[str, Any]) -> str:
+# Long-lived shell shared by all Bash calls; avoids a fork+exec per command
+# and preserves cwd/env changes (cd, export) between calls
+_SHELL = None
+_SHELL_LOCK: asyncio.Lock = asyncio.Lock()
+
+
+async def _get_shell():
+    """Return the persistent shell, spawning or respawning it as needed."""
+    global _SHELL
+    if _SHELL is None or _SHELL.returncode is not None:
+        _SHELL = await asyncio.create_subprocess_exec(
+            "bash",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=BASH_STREAM_LIMIT
+        )
+    return _SHELL
+
+
+async def _reset_shell() -> None:
+    """Kill the persistent shell so the next Bash call starts a fresh one."""
+    global _SHELL
+    if _SHELL is not None and _SHELL.returncode is None:
+        _SHELL.kill()
+        await _SHELL.wait()
+    _SHELL = None
+
+
+def _kill_shell_at_exit() -> None:
+    if _SHELL is not None and _SHELL.returncode is None:
+        try:
+            _SHELL.kill()
+        except ProcessLookupError:
+            pass
+
+
+atexit.register(_kill_shell_at_exit)
+
+
+async def _drain_until_sentinel(stream: asyncio.StreamReader, lines: deque,
+                                sentinel_re: re.Pattern) -> int:
+    """Collect lines into a bounded buffer until the sentinel, returning its code.
+
+    The sentinel is matched as a line suffix: if the command's output didn't
+    end in a newline, the sentinel echo lands on the same line, and the
+    prefix is salvaged as output instead of waiting forever for a match.
+
+    A single line longer than BASH_STREAM_LIMIT is dropped with a note
+    rather than raising: readline's ValueError would otherwise kill the
+    session over one oversized line.
+    """
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # readline discards the oversized data; keep draining for the
+            # sentinel (or the timeout, if it was swallowed with the line).
+            lines.append(f"<line dropped: exceeded {BASH_STREAM_LIMIT} bytes>\n")
+            continue
+        if not line:
+            raise RuntimeError("Shell exited unexpectedly")
+        text = line.decode('utf-8', 'replace')
+        match = sentinel_re.search(text)
+        if match:
+            prefix = text[:match.start()]
+            if prefix:
+                lines.append(prefix)
+            return int(match.group(1))
+        lines.append(text)
+
+
+async def execute_bash_tool(arguments: Dict[str, Any]) -> str:
     """Execute the Bash tool to run a shell command."""
     command = arguments.get("command")
     if not command:
         raise RuntimeError("command parameter is missing")
 
-    try:
-        # Execute the command and capture both stdout and stderr
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            cwd=".",  # Run in current working directory
-            encoding='utf-8'
-        )
+    out_lines: deque = deque(maxlen=BASH_MAX_OUTPUT_LINES)
+    err_lines: deque = deque(maxlen=BASH_MAX_OUTPUT_LINES)
 
-        # Combine stdout and stderr
-        output_parts = []
-        if result.stdout:
-            output_parts.append(result.stdout)
-        if result.stderr:
-            output_parts.append(result.stderr)
+    # A fresh random token per command means output that happens to look
+    # like a sentinel can't desynchronize the shared shell
+    token = uuid.uuid4().hex
+    sentinel_re = re.compile(rf"__{token}_(\d+)__\n?$")
 
-        output = '\n'.join(output_parts).strip()
+    # Commands share one shell, so they must not interleave on its pipes
+    async with _SHELL_LOCK:
+        shell = await _get_shell()
+        try:
+            # Sentinels on both streams mark where this command's output ends;
+            # the stdout one also carries the exit code
+            shell.stdin.write(
+                f"{command}\necho __{token}_$?__\necho __{token}_0__ >&2\n".encode())
+            await shell.stdin.drain()
+
+            returncode, _ = await asyncio.wait_for(
+                asyncio.gather(
+                    _drain_until_sentinel(shell.stdout, out_lines, sentinel_re),
+                    _drain_until_sentinel(shell.stderr, err_lines, sentinel_re)
+                ),
+                timeout=BASH_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            await _reset_shell()
+            raise RuntimeError(f"Command timed out after {BASH_TIMEOUT}s: {command}")
+        except RuntimeError:
+            await _reset_shell()
+            raise
+        except Exception as e:
+            await _reset_shell()
+            raise RuntimeError(f"Error executing command '{command}': {e}")
 
-        # If command failed, include exit code
-        if result.returncode != 0:
-            if output:
-                output = f"Exit code: {result.returncode}\n{output}"
-            else:
-                output = f"Exit code: {result.returncode}"
+    # Combine stdout and stderr
+    output_parts = []
+    stdout = ''.join(out_lines)
+    stderr = ''.join(err_lines)
+    if stdout:
+        output_parts.append(stdout)
+    if stderr:
+        output_parts.append(stderr)
 
-        return output
+    output = '\n'.join(output_parts).strip()
 
-    except Exception as e:
-        raise RuntimeError(f"Error executing command '{command}': {e}")
+    # If command failed, include exit code
+    if returncode != 0:
+        if output:
+            output = f"Exit code: {returncode}\n{output}"
+        else:
+            output = f"Exit code: {returncode}"
 
+    return output
 
+
+# Built once at import time and never mutated, so the serialized form is a
+# stable prefix the provider can serve from its prompt cache. The
+# cache_control marker on the last tool covers the whole tools block.
 TOOLS = [
     {
         "type": "function",
         "function": {
             "name": "Read",
-            "description": "Read and return the contents of a file",
+            "description": "Read and return the contents of a file. Large files are truncated; use offset to page through the rest.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "file_path": {
                         "type": "string",
                         "description": "The path to the file to read"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Byte offset to start reading from (default 0)"
+                    },
+                    "max_bytes": {
+                        "type": "integer",
+                        "description": "Maximum number of bytes to return (default 262144)"
                     }
                 },
                 "required": ["file_path"]
@@ -128,6 +458,55 @@ TOOLS = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "ReadMany",
+            "description": "Read several files in one call; prefer this over multiple Read calls. Returns a JSON array of {file_path, content} objects.",
+            "parameters": {
+                "type": "object",
+                "required": ["file_paths"],
+                "properties": {
+                    "file_paths": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "The paths of the files to read"
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "WriteMany",
+            "description": "Write several files in one call; prefer this over multiple Write calls.",
+            "parameters": {
+                "type": "object",
+                "required": ["files"],
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["file_path", "content"],
+                            "properties": {
+                                "file_path": {
+                                    "type": "string",
+                                    "description": "The path of the file to write to"
+                                },
+                                "content": {
+                                    "type": "string",
+                                    "description": "The content to write to the file"
+                                }
+                            }
+                        },
+                        "description": "The files to write"
+                    }
+                }
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -143,95 +522,262 @@ TOOLS = [
                     }
                 }
             }
-        }
+        },
+        "cache_control": {"type": "ephemeral"}
     }
 ]
 
 
-def execute_tool_call(tool_call: Any) -> str:
-    """Execute a single tool call and return the result."""
-    if tool_call.type != "function":
-        raise RuntimeError(f"Unsupported tool call type: {tool_call.type}")
+# O(1) dispatch table mapping every accepted alias to its tool handler
+DISPATCH: Dict[str, Callable[[Dict[str, Any]], Awaitable[str]]] = {
+    name: fn
+    for names, fn in [
+        (("read", "readfile", "read_file"), execute_read_tool),
+        (("readmany", "read_many"), execute_read_many_tool),
+        (("write", "writefile", "write_file"), execute_write_tool),
+        (("writemany", "write_many"), execute_write_many_tool),
+        (("bash", "shell", "command", "run"), execute_bash_tool),
+    ]
+    for name in names
+}
+
+
+async def execute_tool_call(tool_call: Dict[str, Any]) -> str:
+    """Execute a single tool call (in wire format) and return the result."""
+    if tool_call["type"] != "function":
+        raise RuntimeError(f"Unsupported tool call type: {tool_call['type']}")
+
+    import orjson
 
-    function_name = tool_call.function.name.lower()
+    function = tool_call["function"]
+    function_name = function["name"].lower()
 
     # Parse the arguments JSON string
     try:
-        arguments = json.loads(tool_call.function.arguments)
-    except json.JSONDecodeError:
-        raise RuntimeError(f"Failed to parse arguments: {tool_call.function.arguments}")
+        arguments = orjson.loads(function["arguments"])
+    except orjson.JSONDecodeError:
+        raise RuntimeError(f"Failed to parse arguments: {function['arguments']}")
 
     # Execute the appropriate tool
-    if function_name in ["read", "readfile", "read_file"]:
-        return execute_read_tool(arguments)
-    elif function_name in ["write", "writefile", "write_file"]:
-        return execute_write_tool(arguments)
-    elif function_name in ["bash", "shell", "command", "run"]:
-        return execute_bash_tool(arguments)
-    else:
-        raise RuntimeError(f"Unsupported function: {tool_call.function.name}")
-
+    fn = DISPATCH.get(function_name)
+    if fn is None:
+        raise RuntimeError(f"Unsupported function: {function['name']}")
+    return await fn(arguments)
+
+
+def _history_size(messages: List[Dict[str, Any]]) -> int:
+    """Total content characters currently held in the conversation history."""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            total += sum(len(part.get("text", "")) for part in content)
+    return total
+
+
+def trim_history(messages: List[Dict[str, Any]]) -> None:
+    """Elide old tool-result bodies once the history grows past the threshold.
+
+    The original user message and the most recent tool results stay verbatim;
+    older tool results collapse to a one-line placeholder carrying the size
+    and a hash prefix. Elided entries never change again, so the head of the
+    conversation remains a stable, cacheable prefix. Results of the current
+    turn — everything after the last assistant message — are never elided,
+    however many there are: the model hasn't seen them yet.
+    """
+    if _history_size(messages) <= HISTORY_SIZE_THRESHOLD:
+        return
+
+    turn_start = 0
+    for i, m in enumerate(messages):
+        if m.get("role") == "assistant":
+            turn_start = i + 1
+
+    tool_indexes = [i for i, m in enumerate(messages)
+                    if m.get("role") == "tool" and i < turn_start]
+    for index in tool_indexes[:-HISTORY_KEEP_TOOL_RESULTS]:
+        content = messages[index]["content"]
+        if not isinstance(content, str) or content.startswith("<elided "):
+            continue
+        data = content.encode('utf-8', 'replace')
+        digest = hashlib.sha1(data).hexdigest()[:12]
+        messages[index]["content"] = f"<elided {len(data)} bytes, sha1={digest}>"
+
+
+async def stream_completion(client: AsyncOpenAI, messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Stream one completion with timeout and retries, returning (content, tool_calls)."""
+    import httpx
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+    last_error = None
+    printed = 0  # content bytes already echoed, so a retried stream doesn't re-print
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            stream = await client.chat.completions.create(
+                model="anthropic/claude-haiku-4.5",
+                messages=messages,
+                tools=TOOLS,
+                stream=True,
+                timeout=REQUEST_TIMEOUT,
+                extra_body={"anthropic_beta": "prompt-caching-2024-07-31"}
+            )
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="LLM Agent with file and shell operations")
-    parser.add_argument("-p", required=True, help="Prompt for the LLM")
-    args = parser.parse_args()
+            # Assemble the assistant message incrementally from the deltas
+            content_buf = []
+            tool_calls_by_index: Dict[int, Dict[str, Any]] = {}
+            seen = 0
+
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta is None:
+                    continue
+
+                # Print text as it arrives (only while no tool call is pending,
+                # so partial tool chatter doesn't interleave with real output)
+                if delta.content:
+                    content_buf.append(delta.content)
+                    start = seen
+                    seen += len(delta.content)
+                    if not tool_calls_by_index and seen > printed:
+                        sys.stdout.write(delta.content[max(0, printed - start):])
+                        sys.stdout.flush()
+                        printed = seen
+
+                # Tool calls arrive as fragments keyed by index; concatenate
+                # the arguments JSON until the stream ends
+                if delta.tool_calls:
+                    for tc_delta in delta.tool_calls:
+                        entry = tool_calls_by_index.setdefault(tc_delta.index, {
+                            "id": None,
+                            "type": "function",
+                            "function": {"name": "", "arguments": ""}
+                        })
+                        if tc_delta.id:
+                            entry["id"] = tc_delta.id
+                        if tc_delta.function:
+                            if tc_delta.function.name:
+                                entry["function"]["name"] = tc_delta.function.name
+                            if tc_delta.function.arguments:
+                                entry["function"]["arguments"] += tc_delta.function.arguments
+
+            content = "".join(content_buf)
+            tool_calls = [tool_calls_by_index[i] for i in sorted(tool_calls_by_index)]
+            return content, tool_calls
+
+        except (APITimeoutError, APIConnectionError) as e:
+            last_error = e
+        except httpx.TransportError as e:
+            # A stall or reset during `async for chunk in stream` surfaces as
+            # a raw httpx error (TimeoutException, ReadError, ...) that the
+            # SDK does not translate; retry those too
+            last_error = e
+        except APIStatusError as e:
+            # Only server-side errors are worth retrying
+            if e.status_code < 500:
+                raise
+            last_error = e
+
+        if attempt < MAX_RETRIES - 1:
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    raise RuntimeError(f"Completion failed after {MAX_RETRIES} attempts: {last_error}")
+
+
+async def main() -> None:
+    # The only flag is -p PROMPT; parsing argv by hand avoids argparse's
+    # import and parser-construction cost on every cold start
+    try:
+        prompt = sys.argv[sys.argv.index("-p") + 1]
+    except (ValueError, IndexError):
+        print("usage: main.py -p PROMPT", file=sys.stderr)
+        sys.exit(2)
 
     if not API_KEY:
         raise RuntimeError("OPENROUTER_API_KEY environment variable is not set")
 
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-
-    # Initialize conversation history with user's message
-    messages = [{"role": "user", "content": args.p}]
+    # Deferred until the checks above pass, so aborting is instant
+    import httpx
+    from openai import AsyncOpenAI
+
+    # One warm HTTP/2 connection serves every turn, so only the first call
+    # pays the TCP + TLS handshake
+    http_client = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=1,
+            limits=httpx.Limits(max_keepalive_connections=5, keepalive_expiry=60.0)
+        ),
+        timeout=httpx.Timeout(connect=5.0, read=60.0, write=30.0, pool=5.0)
+    )
+    client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, http_client=http_client)
+
+    # Initialize conversation history with user's message; marking it
+    # cacheable lets the provider reuse its prefill on every later turn
+    messages = [{
+        "role": "user",
+        "content": [{
+            "type": "text",
+            "text": prompt,
+            "cache_control": {"type": "ephemeral"}
+        }]
+    }]
 
     # Agent loop
     while True:
         try:
-            # Send current conversation history to the model
-            chat = client.chat.completions.create(
-                model="anthropic/claude-haiku-4.5",
-                messages=messages,
-                tools=TOOLS
-            )
-
-            if not chat.choices or len(chat.choices) == 0:
-                raise RuntimeError("No choices in response")
+            # Send current conversation history to the model and stream the reply
+            content, tool_calls = await stream_completion(client, messages)
 
-            # Get the assistant's message
-            message = chat.choices[0].message
-
-            # Add the assistant's message to conversation history
+            # Add the reconstructed assistant message to conversation history
             assistant_message = {
                 "role": "assistant",
-                "content": message.content
+                "content": content if content else None
             }
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                assistant_message["tool_calls"] = message.tool_calls
+            if tool_calls:
+                assistant_message["tool_calls"] = tool_calls
             messages.append(assistant_message)
 
             # Check if the assistant wants to use tools
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                # Execute each tool call
-                for tool_call in message.tool_calls:
-                    result = execute_tool_call(tool_call)
-
-                    # Add tool result to conversation history
+            if tool_calls:
+                # Independent tool calls are I/O bound, so run them
+                # concurrently and append results in the original order
+                results = await asyncio.gather(*[
+                    execute_tool_call(tool_call) for tool_call in tool_calls
+                ])
+
+                # Add tool results to conversation history
+                for tool_call, result in zip(tool_calls, results):
                     messages.append({
                         "role": "tool",
-                        "tool_call_id": tool_call.id,
+                        "tool_call_id": tool_call["id"],
                         "content": result
                     })
+
+                # Elide stale tool results before the next upload
+                trim_history(messages)
+
+                # Warm the read cache for files the model is likely to Read
+                # next, overlapping the disk I/O with its generation time
+                for result in results:
+                    _prefetch_candidates(result)
             else:
-                # No tool calls - we have the final answer!
-                final_output = message.content if message.content else ""
-                print(final_output, end="")
+                # No tool calls - the streamed text was the final answer
                 break  # Exit the loop
 
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
 
+    # Don't let stray prefetch tasks hold up shutdown
+    for task in list(_WARM_TASKS):
+        task.cancel()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file